@@ -1,11 +1,14 @@
-import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 from pyrogram import Client
 
 from app.notifications import send_notification
-from app.purchase import buy_gift
-from app.utils.logger import warn, info
+from app.planner import balance_ledger, plan_purchases
+from app.purchase import execute_plan
+from app.utils.deadline import Deadline
+from app.utils.helper import get_user_balance
+from app.utils.journal import purchase_journal
+from app.utils.logger import info
 from data.config import config, t
 
 
@@ -41,25 +44,56 @@ class GiftProcessor:
         )
 
 
-async def process_new_gift(app: Client, gift_data: Dict[str, Any]) -> None:
-    gift_id = gift_data.get("id")
+async def process_new_gifts(app: Client, gifts: List[Dict[str, Any]]) -> None:
+    eligible_gifts, rejected_gifts = [], []
 
-    is_eligible, processing_data = await GiftProcessor.evaluate_gift(gift_data)
+    for gift_data in gifts:
+        gift_id = gift_data.get("id")
+        is_eligible, processing_data = await GiftProcessor.evaluate_gift(gift_data)
 
-    return await send_notification(app, gift_id, **processing_data) if not is_eligible and processing_data else \
-        await _distribute_gifts(app, gift_id, processing_data.get("quantity", 1), processing_data.get("recipients", []))
+        not is_eligible and processing_data and rejected_gifts.append((gift_id, processing_data))
+        is_eligible and eligible_gifts.append({
+            "id": gift_id,
+            "price": gift_data.get("price", 0),
+            "total_amount": gift_data.get("total_amount", 0),
+            "quantity": processing_data.get("quantity", 1),
+            "recipients": processing_data.get("recipients", []),
+            "deadline": Deadline(config.PURCHASE_DEADLINE, gift_data.get("detected_at"))
+        })
 
+    detected_ids = [gift_data.get("id") for gift_data in gifts]
+    if eligible_gifts:
+        await _distribute_gifts(app, eligible_gifts, detected_ids)
+    else:
+        purchase_journal.record([], detected_ids)
 
-async def _distribute_gifts(app: Client, gift_id: int, quantity: int, recipients: list) -> None:
-    info(t("console.processing_gift", gift_id=gift_id, quantity=quantity, recipients_count=len(recipients)))
+    # Rejection notices are sent only once purchases are done so they never delay buying
+    for gift_id, processing_data in rejected_gifts:
+        await send_notification(app, gift_id, **processing_data)
 
-    for recipient_id in recipients:
-        try:
-            await buy_gift(app, recipient_id, gift_id, quantity)
-        except Exception as ex:
-            warn(t("console.purchase_error", gift_id=gift_id, chat_id=recipient_id))
-            await send_notification(app, gift_id, error_message=str(ex))
-        await asyncio.sleep(0.5)
 
+async def _distribute_gifts(app: Client, gifts: List[Dict[str, Any]], detected_ids: List[int]) -> None:
+    for gift in gifts:
+        info(t("console.processing_gift", gift_id=gift["id"], quantity=gift["quantity"],
+               recipients_count=len(gift["recipients"])))
 
-process_gift = process_new_gift
+    # The balance is read outside the lock so a slow request never holds up other purchasers' planning;
+    # anything settled while it was in flight is subtracted afterwards
+    spent_before = balance_ledger.spent
+    user_balance = await get_user_balance(app)
+
+    async with balance_ledger.lock:
+        unseen_spend = balance_ledger.spent - spent_before
+        current_balance = max(user_balance - unseen_spend - balance_ledger.reserved, 0)
+        plan = plan_purchases(gifts, current_balance)
+        purchase_journal.record(plan, detected_ids)
+        balance_ledger.reserve(plan)
+
+    try:
+        await execute_plan(app, plan, current_balance)
+    finally:
+        # Units are released one by one as they are sent; this only catches what an error skipped
+        balance_ledger.release([intent for allocation in plan for intent in allocation['intents']])
+
+
+process_gifts = process_new_gifts
@@ -1,21 +1,31 @@
+import asyncio
+from typing import Set
+
 from pyrogram import Client
 from pyrogram.errors import RPCError
 
+from app.utils.deadline import call_with_timeout
 from app.utils.helper import get_user_balance, format_user_reference
 from app.utils.logger import error
 from data.config import config, t
 
 
 class NotificationManager:
+    # Strong references keep fire-and-forget notifications alive until they are sent
+    background_tasks: Set[asyncio.Task] = set()
+
     @staticmethod
     async def send_message(app: Client, message: str) -> None:
         if not config.CHANNEL_ID:
             return
 
         try:
-            await app.send_message(config.CHANNEL_ID, message, disable_web_page_preview=True)
+            await call_with_timeout(
+                lambda: app.send_message(config.CHANNEL_ID, message, disable_web_page_preview=True))
         except RPCError as ex:
             error(f'Failed to send message to channel {config.CHANNEL_ID}: {str(ex)}')
+        except asyncio.TimeoutError:
+            error(f'Timed out sending message to channel {config.CHANNEL_ID}')
 
     @staticmethod
     async def send_notification(app: Client, gift_id: int, **kwargs) -> None:
@@ -47,6 +57,12 @@ class NotificationManager:
             value and key in message_types and await NotificationManager._send_with_error_handling(
                 app, message_types[key]().strip())
 
+    @staticmethod
+    def send_notification_later(app: Client, gift_id: int, **kwargs) -> None:
+        task = asyncio.create_task(NotificationManager.send_notification(app, gift_id, **kwargs))
+        NotificationManager.background_tasks.add(task)
+        task.add_done_callback(NotificationManager.background_tasks.discard)
+
     @staticmethod
     async def _send_with_error_handling(app: Client, message: str) -> None:
         try:
@@ -91,5 +107,6 @@ class NotificationManager:
 
 send_message = NotificationManager.send_message
 send_notification = NotificationManager.send_notification
+send_notification_later = NotificationManager.send_notification_later
 send_start_message = NotificationManager.send_start_message
 send_summary_message = NotificationManager.send_summary_message
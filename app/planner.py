@@ -0,0 +1,163 @@
+import asyncio
+from math import gcd
+from typing import Any, Callable, Dict, List, Tuple
+
+from data.config import config
+
+
+class PurchasePlanner:
+    # Upper bound for items x capacity cells before the exact knapsack falls back to greedy
+    DP_CELL_LIMIT = 250_000
+    # Relative bonus per priority rank: small enough never to outweigh the objective, so it only decides
+    # between plans the objective values equally
+    PRIORITY_TIE_BREAK = 1e-9
+
+    @staticmethod
+    def get_objectives() -> Dict[str, Callable[[Dict[str, Any]], float]]:
+        return {
+            'rarity': lambda gift: 1 / max(gift.get('total_amount', 0), 1),
+            'count': lambda gift: 1.0,
+            'spend': lambda gift: float(gift['price'])
+        }
+
+    @staticmethod
+    def plan_purchases(gifts: List[Dict[str, Any]], balance: int) -> List[Dict[str, Any]]:
+        requested = {gift['id']: gift['quantity'] * len(gift['recipients']) for gift in gifts}
+
+        selected_units = PurchasePlanner._select_in_order(gifts, requested, balance) \
+            if config.PLAN_OBJECTIVE == 'priority' else PurchasePlanner._select_optimal(gifts, requested, balance)
+
+        return [
+            allocation
+            for gift in gifts
+            for allocation in PurchasePlanner._allocate(gift, selected_units.get(gift['id'], 0))
+        ]
+
+    @staticmethod
+    def _select_in_order(gifts: List[Dict[str, Any]], requested: Dict[int, int], balance: int) -> Dict[int, int]:
+        selected_units = {}
+
+        for gift in gifts:
+            price = gift['price']
+            units = min(requested[gift['id']], balance // price) if price > 0 else requested[gift['id']]
+            selected_units[gift['id']] = units
+            balance -= units * max(price, 0)
+
+        return selected_units
+
+    @staticmethod
+    def _select_optimal(gifts: List[Dict[str, Any]], requested: Dict[int, int], balance: int) -> Dict[int, int]:
+        objectives = PurchasePlanner.get_objectives()
+        objective = objectives.get(config.PLAN_OBJECTIVE, objectives['rarity'])
+        selected_units = {gift['id']: requested[gift['id']] for gift in gifts if gift['price'] <= 0}
+        paid_gifts = [gift for gift in gifts if gift['price'] > 0 and requested[gift['id']] > 0]
+
+        if not paid_gifts or balance <= 0:
+            return selected_units
+
+        step = gcd(*(gift['price'] for gift in paid_gifts))
+        capacity = balance // step
+        items = PurchasePlanner._split_items(paid_gifts, requested, objective, step)
+
+        selected_units.update(
+            PurchasePlanner._solve_knapsack(items, capacity) if len(items) * capacity <= PurchasePlanner.DP_CELL_LIMIT
+            else PurchasePlanner._solve_greedy(paid_gifts, requested, objective, balance)
+        )
+        return selected_units
+
+    @staticmethod
+    def _split_items(gifts: List[Dict[str, Any]], requested: Dict[int, int],
+                     objective: Callable[[Dict[str, Any]], float], step: int) -> List[Tuple[int, int, int, float]]:
+        # Binary splitting turns "up to N units" of one gift into O(log N) 0/1 knapsack items
+        items = []
+
+        for rank, gift in enumerate(gifts):
+            # Gifts arrive in priority order, so earlier ones win ties between otherwise equal plans
+            unit_value = objective(gift) * (1 + PurchasePlanner.PRIORITY_TIE_BREAK * (len(gifts) - rank))
+            remaining, chunk = requested[gift['id']], 1
+            while remaining > 0:
+                units = min(chunk, remaining)
+                items.append((gift['id'], units, units * gift['price'] // step, units * unit_value))
+                remaining -= units
+                chunk *= 2
+
+        return items
+
+    @staticmethod
+    def _solve_knapsack(items: List[Tuple[int, int, int, float]], capacity: int) -> Dict[int, int]:
+        best = [0.0] * (capacity + 1)
+        taken = []
+
+        for _, _, cost, value in items:
+            row = bytearray(capacity + 1)
+            for remaining in range(capacity, cost - 1, -1):
+                candidate = best[remaining - cost] + value
+                if candidate > best[remaining]:
+                    best[remaining] = candidate
+                    row[remaining] = 1
+            taken.append(row)
+
+        selected_units, remaining = {}, capacity
+        for index in range(len(items) - 1, -1, -1):
+            gift_id, units, cost, _ = items[index]
+            if taken[index][remaining]:
+                selected_units[gift_id] = selected_units.get(gift_id, 0) + units
+                remaining -= cost
+
+        return selected_units
+
+    @staticmethod
+    def _solve_greedy(gifts: List[Dict[str, Any]], requested: Dict[int, int],
+                      objective: Callable[[Dict[str, Any]], float], balance: int) -> Dict[int, int]:
+        by_density = sorted(gifts, key=lambda gift: -objective(gift) / gift['price'])
+        return PurchasePlanner._select_in_order(by_density, requested, balance)
+
+    @staticmethod
+    def _allocate(gift: Dict[str, Any], units: int) -> List[Dict[str, Any]]:
+        recipients = gift['recipients']
+        base_share, extra = divmod(units, len(recipients)) if recipients else (0, 0)
+
+        return [
+            {
+                'gift_id': gift['id'],
+                'recipient': recipient,
+                'price': gift['price'],
+                'requested': gift['quantity'],
+                'quantity': base_share + (1 if index < extra else 0),
+                'deadline': gift.get('deadline')
+            }
+            for index, recipient in enumerate(recipients)
+        ]
+
+
+class BalanceLedger:
+    # Concurrent purchasers plan against the balance minus what other in-flight plans have yet to spend.
+    # Each unit is reserved by intent id and released as soon as its send finishes or is aborted,
+    # so money already gone from the balance is never subtracted a second time
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.reservations: Dict[str, int] = {}
+        # Running total of settled spend, so a balance read before taking the lock can be brought up to date
+        self.spent = 0
+
+    @property
+    def reserved(self) -> int:
+        return sum(self.reservations.values())
+
+    def reserve(self, plan: List[Dict[str, Any]]) -> None:
+        self.reservations.update(
+            (intent['id'], max(allocation['price'], 0)) for allocation in plan for intent in allocation['intents']
+        )
+
+    def release(self, intents: List[Dict[str, Any]]) -> None:
+        for intent in intents:
+            self.reservations.pop(intent['id'], None)
+
+    def settle(self, intents: List[Dict[str, Any]]) -> None:
+        # Sent units leave the reservations and count as spent instead
+        for intent in intents:
+            self.spent += self.reservations.pop(intent['id'], 0)
+
+
+plan_purchases = PurchasePlanner.plan_purchases
+balance_ledger = BalanceLedger()
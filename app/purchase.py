@@ -1,55 +1,206 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 from pyrogram import Client
 from pyrogram.errors import RPCError
 
 from app.errors import handle_gift_error
-from app.notifications import send_notification
+from app.notifications import send_notification, send_notification_later
+from app.planner import balance_ledger
+from app.utils.connection import ensure_connected
+from app.utils.deadline import Deadline, DeadlineExceeded, call_with_timeout, read_with_retries
+from app.utils.detector import GiftDetector
 from app.utils.helper import get_recipient_info, get_user_balance
+from app.utils.journal import purchase_journal
 from app.utils.logger import info, warn
-from data.config import t
+from app.utils.pipeline import purchase_queue
+from app.utils.profiler import trace_span
+from data.config import config, t
 
 
 class GiftPurchaser:
     @staticmethod
-    async def buy_gift(app: Client, chat_id: int, gift_id: int, quantity: int = 1) -> None:
-        recipient_info, username = await get_recipient_info(app, chat_id)
-        gift_price = await GiftPurchaser._get_gift_price(app, gift_id)
-        current_balance = await get_user_balance(app)
+    async def execute_plan(app: Client, plan: List[Dict[str, Any]], current_balance: int) -> None:
+        # Waiting for a reconnect never eats into the time the most urgent gift has left
+        deadlines = [allocation['deadline'].remaining for allocation in plan if allocation.get('deadline')]
+        await ensure_connected(app, min(deadlines) if deadlines else None)
+
+        gift_jobs = {}
+        for allocation in plan:
+            gift_jobs.setdefault(allocation['gift_id'], []).append((allocation, current_balance))
+            current_balance -= allocation['quantity'] * max(allocation['price'], 0)
+
+        # Gifts are bought concurrently so a slow or hung RPC for one gift never holds up the others
+        await asyncio.gather(*(GiftPurchaser._execute_gift_jobs(app, jobs) for jobs in gift_jobs.values()))
+
+        purchase_journal.compact()
+
+    @staticmethod
+    async def _execute_gift_jobs(app: Client, jobs: List[Tuple[Dict[str, Any], int]]) -> None:
+        for allocation, current_balance in jobs:
+            gift_id, chat_id = allocation['gift_id'], allocation['recipient']
+
+            if GiftPurchaser._should_stop(gift_id, allocation.get('deadline')):
+                purchase_journal.resolve(allocation['intents'])
+                balance_ledger.release(allocation['intents'])
+                continue
+
+            try:
+                await GiftPurchaser._execute_allocation(app, allocation, current_balance)
+            except Exception as ex:
+                warn(t("console.purchase_error", gift_id=gift_id, chat_id=chat_id))
+                await send_notification(app, gift_id, error_message=str(ex))
+            await asyncio.sleep(0.5)
+
+    @staticmethod
+    def _should_stop(gift_id: int, deadline: Optional[Deadline]) -> bool:
+        stop_rules = {
+            'cancelled': lambda: purchase_queue.is_cancelled(gift_id),
+            'deadline_exceeded': lambda: deadline is not None and deadline.expired
+        }
+
+        stop_reason = next((reason for reason, condition in stop_rules.items() if condition()), None)
+        stop_reason == 'deadline_exceeded' and warn(t("console.deadline_exceeded", gift_id=gift_id))
+        return stop_reason is not None
+
+    @staticmethod
+    async def resume_purchases(app: Client, callback: Callable) -> None:
+        # Rewrite the journal first so new entries are never appended after a torn line
+        purchase_journal.compact()
+        pending, uncertain, detected = purchase_journal.load_unfinished()
+
+        for intent in uncertain:
+            warn(t("console.intent_uncertain", gift_id=intent['gift_id'], chat_id=intent['recipient']))
+        purchase_journal.resolve(uncertain, 'uncertain')
+
+        try:
+            (pending or detected) and await GiftPurchaser._resume_unfinished(app, callback, pending, detected)
+        except (asyncio.TimeoutError, ConnectionError, OSError, RPCError) as ex:
+            # Whatever was not resolved stays in the journal and is retried on the next start
+            warn(t("console.resume_failed", error=str(ex) or type(ex).__name__))
+
+        purchase_journal.compact()
+
+    @staticmethod
+    async def _resume_unfinished(app: Client, callback: Callable, pending: List[Dict[str, Any]],
+                                 detected: List[Dict[str, Any]]) -> None:
+        current_gifts, gift_ids = await GiftDetector.fetch_current_gifts(app)
+        is_buyable = {
+            gift_id: not gift_data.get("is_sold_out", False) for gift_id, gift_data in current_gifts.items()
+        }
+
+        resumable = [intent for intent in pending if is_buyable.get(intent['gift_id'])]
+        purchase_journal.resolve([intent for intent in pending if intent not in resumable])
+
+        resumable and info(t("console.resuming_purchases", count=len(resumable)))
 
-        max_affordable = min(quantity, current_balance // gift_price) if gift_price > 0 else quantity
+        grouped_intents = {}
+        for intent in resumable:
+            grouped_intents.setdefault((intent['gift_id'], intent['recipient']), []).append(intent)
 
-        max_affordable == 0 and await GiftPurchaser._handle_insufficient_balance(
-            app, gift_id, gift_price, current_balance, quantity)
+        for (gift_id, chat_id), intents in grouped_intents.items():
+            deadline = Deadline(config.PURCHASE_DEADLINE)
+            recipient_info, username = await get_recipient_info(app, chat_id, deadline)
+            await GiftPurchaser._purchase_gifts(app, chat_id, gift_id, intents, recipient_info, username, deadline)
 
-        await GiftPurchaser._purchase_gifts(app, chat_id, gift_id, max_affordable, recipient_info, username)
+        # Gifts detected but never planned go through evaluation and planning again
+        replannable = {
+            entry['gift_id']: current_gifts[entry['gift_id']] for entry in detected
+            if entry['gift_id'] in current_gifts
+        }
+        purchase_journal.resolve([entry for entry in detected if entry['gift_id'] not in replannable])
 
-        max_affordable < quantity and await GiftPurchaser._notify_partial_purchase(
-            app, gift_id, quantity, max_affordable, gift_price, current_balance)
+        if not replannable:
+            return
+
+        # The crash may have come before the catalog was saved; without this the detection loop would find
+        # these gifts again and buy them a second time
+        known_gifts = await GiftDetector.load_gift_history()
+        known_gifts.update(replannable)
+        await GiftDetector.save_gift_history(list(known_gifts.values()))
+
+        info(t("console.replanning_gifts", count=len(replannable)))
+        prioritized_gifts = GiftDetector.prioritize_gifts(replannable, gift_ids)
+        for gift_id, gift_data in prioritized_gifts:
+            gift_data['id'] = gift_id
+        await callback(app, [gift_data for _, gift_data in prioritized_gifts])
+
+    @staticmethod
+    async def _execute_allocation(app: Client, allocation: Dict[str, Any], current_balance: int) -> None:
+        gift_id, chat_id = allocation['gift_id'], allocation['recipient']
+        quantity, requested, gift_price = allocation['quantity'], allocation['requested'], allocation['price']
+
+        with trace_span(f"buy_gift {gift_id} -> {chat_id}", config.SLOW_PURCHASE_THRESHOLD):
+            with trace_span("get_recipient_info"):
+                recipient_info, username = await get_recipient_info(app, chat_id, allocation.get('deadline'))
+
+            with trace_span("insufficient_balance_notice"):
+                quantity == 0 and await GiftPurchaser._handle_insufficient_balance(
+                    app, gift_id, gift_price, current_balance, requested)
+
+            await GiftPurchaser._purchase_gifts(app, chat_id, gift_id, allocation['intents'],
+                                                recipient_info, username, allocation.get('deadline'))
+
+            with trace_span("partial_purchase_notice"):
+                quantity < requested and await GiftPurchaser._notify_partial_purchase(
+                    app, gift_id, requested, quantity, gift_price, current_balance)
 
     @staticmethod
     async def _get_gift_price(app: Client, gift_id: int) -> int:
         try:
-            gifts = await app.get_available_gifts()
+            gifts = await read_with_retries(app.get_available_gifts)
             return next((gift.price for gift in gifts if gift.id == gift_id), 0)
         except Exception:
             return 0
 
     @staticmethod
-    async def _purchase_gifts(app: Client, chat_id: int, gift_id: int, quantity: int,
-                              recipient_info: str, username: str) -> None:
-        for i in range(quantity):
-            current_gift = i + 1
-            try:
-                await app.send_gift(chat_id=chat_id, gift_id=gift_id, hide_my_name=True)
-                info(t("console.gift_sent", current=current_gift, total=quantity,
-                          gift_id=gift_id, recipient=recipient_info))
-                await send_notification(app, gift_id, user_id=chat_id, username=username,
-                                        current_gift=current_gift, total_gifts=quantity,
-                                        success_message=True)
-            except RPCError as ex:
-                current_balance = await get_user_balance(app)
-                await handle_gift_error(app, ex, gift_id, chat_id,
-                                        await GiftPurchaser._get_gift_price(app, gift_id), current_balance)
-                break
+    async def _purchase_gifts(app: Client, chat_id: int, gift_id: int, intents: List[Dict[str, Any]],
+                              recipient_info: str, username: str, deadline: Optional[Deadline] = None) -> None:
+        attempted = 0
+
+        try:
+            for intent in intents:
+                if GiftPurchaser._should_stop(gift_id, deadline):
+                    break
+
+                attempted += 1
+                try:
+                    with trace_span(f"send_gift {intent['unit']}/{intent['total']}"):
+                        purchase_journal.begin(intent)
+                        # Never retried: a send that timed out may still have gone through
+                        await call_with_timeout(
+                            lambda: app.send_gift(chat_id=chat_id, gift_id=gift_id, hide_my_name=True), deadline)
+                        purchase_journal.complete(intent)
+                        balance_ledger.settle([intent])
+                    info(t("console.gift_sent", current=intent['unit'], total=intent['total'],
+                           gift_id=gift_id, recipient=recipient_info))
+                    # Sent in the background so the next unit's send never waits on the channel post
+                    send_notification_later(app, gift_id, user_id=chat_id, username=username,
+                                            current_gift=intent['unit'], total_gifts=intent['total'],
+                                            success_message=True)
+                except DeadlineExceeded:
+                    # Raised before the request went out, so nothing can have been spent on this unit
+                    purchase_journal.resolve([intent])
+                    balance_ledger.release([intent])
+                    warn(t("console.deadline_exceeded", gift_id=gift_id))
+                    break
+                except asyncio.TimeoutError:
+                    purchase_journal.resolve([intent], 'uncertain')
+                    warn(t("console.send_timeout", gift_id=gift_id, chat_id=chat_id))
+                    break
+                except RPCError as ex:
+                    # The server rejected the purchase, so nothing was spent on this unit
+                    purchase_journal.resolve([intent])
+                    balance_ledger.release([intent])
+                    'STARGIFT_USAGE_LIMITED' in str(ex) and purchase_queue.cancel(gift_id)
+                    with trace_span("handle_gift_error"):
+                        current_balance = await get_user_balance(app)
+                        await handle_gift_error(app, ex, gift_id, chat_id,
+                                                await GiftPurchaser._get_gift_price(app, gift_id), current_balance)
+                    break
+        finally:
+            purchase_journal.resolve(intents[attempted:])
+            balance_ledger.release(intents)
 
     @staticmethod
     async def _handle_insufficient_balance(app: Client, gift_id: int, gift_price: int, current_balance: int,
@@ -77,4 +228,5 @@ class GiftPurchaser:
                                 current_balance=remaining_balance)
 
 
-buy_gift = GiftPurchaser.buy_gift
+execute_plan = GiftPurchaser.execute_plan
+resume_purchases = GiftPurchaser.resume_purchases
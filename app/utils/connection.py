@@ -0,0 +1,131 @@
+import asyncio
+import random
+import time
+from typing import Any, Dict, Optional
+
+from pyrogram import Client, raw
+
+from app.utils.logger import info, warn
+from data.config import config, t
+
+
+class ConnectionSupervisor:
+    def __init__(self, client: Client, name: str):
+        self.client = client
+        self.name = name
+        self.rtt: Optional[float] = None
+        self.last_ok = time.monotonic()
+        self.reconnects = 0
+        self.healthy = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.restart_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.client.is_connected and self.healthy.set()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self.task and self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True) if self.task else None
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> None:
+        try:
+            await asyncio.wait_for(self.healthy.wait(), config.INTERVAL if timeout is None else max(timeout, 0))
+        except asyncio.TimeoutError:
+            # Still reconnecting; let the caller try anyway rather than skip the cycle
+            pass
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'healthy': self.healthy.is_set(),
+            'rtt': self.rtt,
+            'last_ok_age': time.monotonic() - self.last_ok,
+            'reconnects': self.reconnects
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await (asyncio.sleep(config.PING_INTERVAL) if await self._ping() else self._reconnect())
+
+    async def _ping(self) -> bool:
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(
+                self.client.invoke(raw.functions.Ping(ping_id=random.getrandbits(63))), config.PING_TIMEOUT)
+        except Exception:
+            return False
+
+        self.last_ok = time.monotonic()
+        rtt = self.last_ok - started
+        # Exponentially weighted so a single slow ping does not swing the reported latency
+        self.rtt = rtt if self.rtt is None else self.rtt * 0.8 + rtt * 0.2
+        self.healthy.set()
+        return True
+
+    async def _reconnect(self) -> None:
+        self.healthy.clear()
+        warn(t("console.connection_stalled", name=self.name, timeout=config.PING_TIMEOUT))
+
+        for attempt in range(1, config.RECONNECT_ATTEMPTS + 1):
+            try:
+                await self._restart_session()
+                if await self._ping():
+                    self.reconnects += 1
+                    return info(t("console.connection_restored", name=self.name, rtt=round(self.rtt * 1000)))
+            except Exception as ex:
+                warn(t("console.reconnect_failed", name=self.name, attempt=attempt, error=str(ex)))
+
+            delay = min(config.RECONNECT_BACKOFF * 2 ** (attempt - 1), config.RECONNECT_BACKOFF_MAX)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+
+    async def _restart_session(self) -> None:
+        session = self.client.session
+        # pyrofork's ping and recv workers restart the session on socket errors by themselves; is_started
+        # stays clear while that runs, and a second restart on top would tear down the one in progress
+        if self.client.is_connected and not session.is_started.is_set():
+            return await asyncio.wait_for(session.is_started.wait(), config.PING_TIMEOUT * 2)
+
+        # A live client with a stalled socket only needs its session restarted, which is much
+        # cheaper than a full client restart and keeps registered handlers
+        if not self.restart_task or self.restart_task.done():
+            self.restart_task = asyncio.create_task(
+                session.restart() if self.client.is_connected else self.client.start())
+            # Failures are reported by the attempt that awaits the task; this only keeps asyncio from warning
+            self.restart_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+        # Only the wait times out: cancelling start() or stop() halfway would leave the session half torn down,
+        # so a slow restart keeps running and the next attempt waits for it instead of starting another
+        done, _ = await asyncio.wait({self.restart_task}, timeout=config.PING_TIMEOUT * 2)
+        if not done:
+            raise asyncio.TimeoutError("Session restart is still in progress")
+        self.restart_task.result()
+
+
+class ConnectionManager:
+    supervisors: Dict[Client, ConnectionSupervisor] = {}
+
+    @staticmethod
+    def supervise(client: Client, name: str) -> ConnectionSupervisor:
+        supervisor = ConnectionManager.supervisors.setdefault(client, ConnectionSupervisor(client, name))
+        supervisor.task or supervisor.start()
+        return supervisor
+
+    @staticmethod
+    async def release(client: Client) -> None:
+        supervisor = ConnectionManager.supervisors.pop(client, None)
+        supervisor and await supervisor.stop()
+
+    @staticmethod
+    async def ensure_connected(client: Client, timeout: Optional[float] = None) -> None:
+        supervisor = ConnectionManager.supervisors.get(client)
+        await supervisor.wait_ready(timeout) if supervisor else (client.is_connected or await client.start())
+
+    @staticmethod
+    def get_connection_health() -> Dict[str, Dict[str, Any]]:
+        return {supervisor.name: supervisor.get_status() for supervisor in ConnectionManager.supervisors.values()}
+
+
+supervise_connection = ConnectionManager.supervise
+release_connection = ConnectionManager.release
+ensure_connected = ConnectionManager.ensure_connected
+get_connection_health = ConnectionManager.get_connection_health
@@ -0,0 +1,55 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from data.config import config
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    # Raised before a request is made, so unlike a timed out request it is known not to have reached the server
+    pass
+
+
+class Deadline:
+    def __init__(self, budget: float, started_at: Optional[float] = None):
+        self.expires_at = (started_at if started_at is not None else time.monotonic()) + budget
+
+    @property
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining <= 0
+
+    def get_timeout(self) -> float:
+        return min(config.RPC_TIMEOUT, self.remaining)
+
+
+class RPCTimeouts:
+    # Errors worth retrying for reads: the request timed out or the connection dropped under it
+    RETRYABLE_ERRORS = (asyncio.TimeoutError, ConnectionError, OSError)
+
+    @staticmethod
+    async def call_with_timeout(call: Callable[[], Awaitable[Any]], deadline: Optional[Deadline] = None,
+                                retries: int = 0) -> Any:
+        for attempt in range(retries + 1):
+            timeout = deadline.get_timeout() if deadline else config.RPC_TIMEOUT
+            if timeout <= 0:
+                raise DeadlineExceeded("Purchase deadline exceeded")
+
+            try:
+                return await asyncio.wait_for(call(), timeout)
+            except RPCTimeouts.RETRYABLE_ERRORS:
+                if attempt == retries:
+                    raise
+                await asyncio.sleep(min(0.2 * 2 ** attempt, 1.0))
+
+    @staticmethod
+    async def read_with_retries(call: Callable[[], Awaitable[Any]], deadline: Optional[Deadline] = None) -> Any:
+        # Only idempotent reads may be retried; a repeated write such as send_gift could spend twice
+        return await RPCTimeouts.call_with_timeout(call, deadline, retries=config.RPC_RETRIES)
+
+
+call_with_timeout = RPCTimeouts.call_with_timeout
+read_with_retries = RPCTimeouts.read_with_retries
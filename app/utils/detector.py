@@ -1,16 +1,72 @@
 import asyncio
 import json
+import math
+import os
 import random
 import time
-from typing import Any, Callable, Dict, List, Tuple
+import traceback
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Tuple
 
 from pyrogram import Client, types
+from pyrogram.errors import FloodWait, RPCError
 
 from app.notifications import send_summary_message
-from app.utils.logger import log_same_line, info
+from app.utils.connection import ensure_connected, release_connection, supervise_connection
+from app.utils.deadline import read_with_retries
+from app.utils.journal import purchase_journal
+from app.utils.logger import log_same_line, info, warn, error
+from app.utils.pipeline import purchase_queue
+from app.utils.profiler import cycle_profiler, trace_span
+from app.utils.triggers import detection_trigger
 from data.config import config, t
 
 
+class SupplyTracker:
+    def __init__(self, window: int):
+        self.window = max(window, 2)
+        self.samples: Dict[int, Deque[Tuple[float, int]]] = {}
+
+    def record(self, gifts: Dict[int, dict]) -> None:
+        now = time.monotonic()
+        trackable = {
+            gift_id: gift_data["available_amount"] for gift_id, gift_data in gifts.items()
+            if gift_data.get("is_limited") and not gift_data.get("is_sold_out")
+            and gift_data.get("available_amount") is not None
+        }
+
+        for gift_id in set(self.samples) - set(trackable):
+            del self.samples[gift_id]
+
+        for gift_id, available_amount in trackable.items():
+            self.samples.setdefault(gift_id, deque(maxlen=self.window)).append((now, available_amount))
+
+    def get_velocity(self, gift_id: int) -> float:
+        samples = self.samples.get(gift_id)
+        if not samples or len(samples) < 2:
+            return 0.0
+
+        (first_time, first_amount), (last_time, last_amount) = samples[0], samples[-1]
+        elapsed = last_time - first_time
+        return max(first_amount - last_amount, 0) / elapsed if elapsed > 0 else 0.0
+
+    def estimate_sell_out(self, gift_id: int) -> float:
+        velocity = self.get_velocity(gift_id)
+        return self.samples[gift_id][-1][1] / velocity if velocity > 0 else float('inf')
+
+    def get_sell_out_key(self, gift_id: int, gift_data: dict) -> Tuple[float, float]:
+        # A freshly detected gift has a single sample and no velocity yet, so the remaining supply
+        # breaks the tie: at equal demand, the gift with fewer units left sells out first
+        available_amount = gift_data.get("available_amount")
+        return self.estimate_sell_out(gift_id), available_amount if available_amount is not None else float('inf')
+
+    def is_draining(self) -> bool:
+        return any(self.estimate_sell_out(gift_id) <= config.BURST_HORIZON for gift_id in self.samples)
+
+
+supply_tracker = SupplyTracker(config.SUPPLY_HISTORY_SIZE)
+
+
 class GiftDetector:
     @staticmethod
     async def load_gift_history() -> Dict[int, dict]:
@@ -22,14 +78,21 @@ class GiftDetector:
 
     @staticmethod
     async def save_gift_history(gifts: List[dict]) -> None:
-        with config.DATA_FILEPATH.open("w", encoding='utf-8') as file:
+        # Written to a temporary file first so a crash mid-write never leaves unreadable history behind
+        temp_path = config.DATA_FILEPATH.with_suffix('.tmp')
+
+        with temp_path.open("w", encoding='utf-8') as file:
             json.dump(gifts, file, indent=4, default=types.Object.default, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_path, config.DATA_FILEPATH)
 
     @staticmethod
     async def fetch_current_gifts(app: Client) -> Tuple[Dict[int, dict], List[int]]:
         gifts = [
             json.loads(json.dumps(gift, default=types.Object.default, ensure_ascii=False))
-            for gift in await app.get_available_gifts()
+            for gift in await read_with_retries(app.get_available_gifts)
         ]
         gifts_dict = {gift["id"]: gift for gift in gifts}
         return gifts_dict, list(gifts_dict.keys())
@@ -48,58 +111,261 @@ class GiftDetector:
         for gift_id, gift_data in gifts.items():
             gift_data["position"] = len(gift_ids) - gift_ids.index(gift_id)
 
-        sorted_gifts = sorted(gifts.items(), key=lambda x: x[1]["position"])
+        return sorted(gifts.items(), key=lambda x: GiftDetector.get_priority_key(*x))
+
+    @staticmethod
+    def get_priority_key(gift_id: int, gift_data: dict) -> Tuple:
+        priority_keys = {
+            'sell_out': {
+                'enabled': config.PRIORITIZE_SELL_OUT,
+                'key': lambda: supply_tracker.get_sell_out_key(gift_id, gift_data)
+            },
+            'low_supply': {
+                'enabled': config.PRIORITIZE_LOW_SUPPLY,
+                'key': lambda: gift_data.get("total_amount", float('inf')) if gift_data.get("is_limited", False)
+                else float('inf')
+            }
+        }
+
+        return (*(rule['key']() for rule in priority_keys.values() if rule['enabled']), gift_data["position"])
+
+
+class CatalogMerger:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.known_gifts: Dict[int, dict] = {}
+        self.last_new_at = float('-inf')
+
+    async def load(self) -> None:
+        self.known_gifts = await GiftDetector.load_gift_history()
+
+    async def merge(self, current_gifts: Dict[int, dict]) -> Dict[int, dict]:
+        async with self.lock:
+            supply_tracker.record(current_gifts)
+
+            new_gifts = {
+                gift_id: gift_data for gift_id, gift_data in current_gifts.items()
+                if gift_id not in self.known_gifts
+            }
+
+            if not new_gifts:
+                return {}
+
+            self.last_new_at = time.monotonic()
+            # History is a union of everything any poller has seen, so a poller holding an older snapshot
+            # can never make an already handled gift look new again
+            self.known_gifts.update(current_gifts)
+
+            # Journal the new gifts before persisting the catalog: after a crash they are no longer re-detected,
+            # so the journal is what brings them back for planning or resumes their unfinished purchases
+            with trace_span("journal_detected"):
+                purchase_journal.detect(list(new_gifts))
+
+            with trace_span("save_gift_history"):
+                await GiftDetector.save_gift_history(list(self.known_gifts.values()))
+            return new_gifts
+
+
+class PollSchedule:
+    # Every poller is pinned to one shared grid (base + k * period + index * stagger), so slow cycles,
+    # reconnects and jitter never let pollers drift into each other
+    def __init__(self, base: float, index: int, count: int):
+        self.base = base
+        self.index = index
+        self.count = count
+        self.scheduled = base + index * config.INTERVAL / count
+
+    def next_delay(self) -> float:
+        # Poll faster while a tracked limited gift is about to sell out
+        period = config.BURST_INTERVAL if config.BURST_INTERVAL > 0 and supply_tracker.is_draining() \
+            else config.INTERVAL
+        stagger = period / self.count
+        offset = self.base + self.index * stagger
 
-        return sorted(sorted_gifts, key=lambda x: (
-            x[1].get("total_amount", float('inf')) if x[1].get("is_limited", False) else float('inf'),
-            x[1]["position"]
-        )) if config.PRIORITIZE_LOW_SUPPLY else sorted_gifts
+        # The next slot comes after both the last one and now; slots missed by a long cycle are skipped
+        after = max(self.scheduled, time.monotonic())
+        self.scheduled = offset + (math.floor((after - offset) / period + 1e-6) + 1) * period
+
+        # Jitter stays well under the stagger so neighbouring pollers never bunch up or swap places
+        jitter = random.uniform(-1, 1) * min(3.0, stagger / 4)
+        return max(self.scheduled + jitter - time.monotonic(), 0.0)
 
 
 class GiftMonitor:
     @staticmethod
     async def run_detection_loop(app: Client, callback: Callable) -> None:
+        merger = CatalogMerger()
+        await merger.load()
+        detection_trigger.register(app)
+        cycle_profiler.install()
+
+        poller_clients = [app, *await GiftMonitor._start_poller_clients(app)]
+        base = time.monotonic()
+
+        for index, client in enumerate(poller_clients):
+            supervise_connection(client, f"poller_{index}" if index else "main")
+
+        try:
+            await asyncio.gather(
+                *(GiftMonitor._run_poller(client, merger, PollSchedule(base, index, len(poller_clients)))
+                  for index, client in enumerate(poller_clients)),
+                *(GiftMonitor._run_purchaser(app, callback) for _ in range(max(config.PURCHASE_WORKERS, 1)))
+            )
+        finally:
+            for client in poller_clients:
+                await release_connection(client)
+            for client in poller_clients[1:]:
+                client.is_connected and await client.stop()
+
+    @staticmethod
+    async def _run_poller(client: Client, merger: CatalogMerger, schedule: PollSchedule) -> None:
         animation_counter = 0
+        primary = schedule.index == 0
+        await asyncio.sleep(max(schedule.scheduled - time.monotonic(), 0.0))
 
         while True:
-            animation_counter = (animation_counter + 1) % 4
-            log_same_line(f'{t("console.gift_checking")}{"." * animation_counter}')
-            time.sleep(0.2)
+            if primary:
+                animation_counter = (animation_counter + 1) % 4
+                queue_stats = purchase_queue.stats()
+                queue_status = t("console.queue_status", depth=queue_stats['depth'],
+                                 age=round(queue_stats['oldest_age'], 1)) if queue_stats['depth'] else ""
+                log_same_line(f'{t("console.gift_checking")}{"." * animation_counter}{queue_status}')
+                await asyncio.sleep(0.2)
 
-            app.is_connected or await app.start()
+            backoff = 0.0
 
-            old_gifts = await GiftDetector.load_gift_history()
-            current_gifts, gift_ids = await GiftDetector.fetch_current_gifts(app)
+            # Extra pollers only hedge while the catalog is active; a quiet catalog is left to the main poller
+            if primary or GiftMonitor._is_catalog_active(merger):
+                primary and cycle_profiler.cycle_started()
+                try:
+                    await GiftMonitor._poll_catalog(client, merger)
+                except FloodWait as ex:
+                    # The limit is account-wide: back off for as long as the server asks instead of polling into it
+                    warn(t("console.poll_failed", error=str(ex)))
+                    backoff = float(ex.value or 0)
+                except RPCError as ex:
+                    warn(t("console.poll_failed", error=str(ex)))
+                    # An extra session the server refuses (e.g. AUTH_KEY_DUPLICATED) is dropped, not retried
+                    if not primary:
+                        warn(t("console.poller_dropped", index=schedule.index))
+                        return await release_connection(client)
+                finally:
+                    primary and cycle_profiler.cycle_finished()
 
-            new_gifts = {
-                gift_id: gift_data for gift_id, gift_data in current_gifts.items()
-                if gift_id not in old_gifts
-            }
+            await asyncio.sleep(backoff)
+
+            # The primary poller also wakes up early when an update hints at a catalog change
+            await (detection_trigger.wait(schedule.next_delay()) if primary
+                   else asyncio.sleep(schedule.next_delay()))
+
+    @staticmethod
+    async def _poll_catalog(client: Client, merger: CatalogMerger) -> None:
+        with trace_span("detection_cycle", config.SLOW_CYCLE_THRESHOLD):
+            with trace_span("ensure_connected"):
+                await ensure_connected(client)
+
+            try:
+                with trace_span("fetch_current_gifts"):
+                    current_gifts, gift_ids = await GiftDetector.fetch_current_gifts(client)
+            except (asyncio.TimeoutError, ConnectionError, OSError) as ex:
+                # A failed poll says nothing about the catalog, so supply history and the queue stay as they are
+                return warn(t("console.poll_failed", error=str(ex) or type(ex).__name__))
 
-            new_gifts and await GiftMonitor._process_new_gifts(app, new_gifts, gift_ids, callback)
+            with trace_span("merge"):
+                new_gifts = await merger.merge(current_gifts)
 
-            await GiftDetector.save_gift_history(list(current_gifts.values()))
-            # Add randomization of -3 to +3 seconds to the interval
-            randomized_interval = config.INTERVAL + random.uniform(-3, 3)
-            await asyncio.sleep(randomized_interval)
+            with trace_span("enqueue"):
+                GiftMonitor._cancel_sold_out_gifts(current_gifts)
+                GiftMonitor._reprioritize_queued_gifts(current_gifts, gift_ids)
+                new_gifts and GiftMonitor._enqueue_new_gifts(new_gifts, gift_ids)
 
     @staticmethod
-    async def _process_new_gifts(app: Client, new_gifts: Dict[int, dict],
-                                 gift_ids: List[int], callback: Callable) -> None:
+    def _is_catalog_active(merger: CatalogMerger) -> bool:
+        last_activity = max(merger.last_new_at, detection_trigger.last_fired)
+        return supply_tracker.is_draining() or time.monotonic() - last_activity <= config.HEDGE_WINDOW
+
+    @staticmethod
+    async def _start_poller_clients(app: Client) -> List[Client]:
+        if config.POLLERS <= 1:
+            return []
+
+        # Extra pollers reuse the account's authorization over their own connections, so every session
+        # keeps the usual request rate while detection delay shrinks by the number of pollers
+        session_string = await app.export_session_string()
+        clients = []
+
+        for index in range(1, config.POLLERS):
+            client = Client(
+                name=f"poller_{index}",
+                api_id=config.API_ID,
+                api_hash=config.API_HASH,
+                session_string=session_string,
+                in_memory=True,
+                no_updates=True
+            )
+            try:
+                await client.start()
+                clients.append(client)
+            except Exception as ex:
+                warn(t("console.poller_start_error", index=index, error=str(ex)))
+
+        return clients
+
+    @staticmethod
+    def _enqueue_new_gifts(new_gifts: Dict[int, dict], gift_ids: List[int]) -> None:
         info(f'{t("console.new_gifts")} {len(new_gifts)}')
+        GiftMonitor._queue_gifts(new_gifts, gift_ids)
+
+    @staticmethod
+    def _reprioritize_queued_gifts(current_gifts: Dict[int, dict], gift_ids: List[int]) -> None:
+        # Gifts still waiting for a purchaser pick up the latest supply data from every poll
+        GiftMonitor._queue_gifts({
+            gift_id: gift_data for gift_id, gift_data in current_gifts.items() if gift_id in purchase_queue
+        }, gift_ids)
 
+    @staticmethod
+    def _cancel_sold_out_gifts(current_gifts: Dict[int, dict]) -> None:
+        # Only an explicit sold-out flag cancels: a poller's snapshot may predate a gift, so absence proves nothing
+        for gift_id in purchase_queue.get_tracked_ids():
+            if current_gifts.get(gift_id, {}).get("is_sold_out") and not purchase_queue.is_cancelled(gift_id):
+                purchase_queue.cancel(gift_id)
+                info(t("console.purchase_cancelled", gift_id=gift_id))
+
+    @staticmethod
+    def _queue_gifts(gifts: Dict[int, dict], gift_ids: List[int]) -> None:
+        for gift_id, gift_data in GiftDetector.prioritize_gifts(gifts, gift_ids):
+            gift_data['id'] = gift_id
+            purchase_queue.put(gift_data, GiftDetector.get_priority_key(gift_id, gift_data))
+
+    @staticmethod
+    async def _run_purchaser(app: Client, callback: Callable) -> None:
+        while True:
+            batch = await purchase_queue.get_batch()
+            waited = time.monotonic() - min(entry['enqueued_at'] for entry in batch)
+            info(t("console.queue_batch", count=len(batch), waited=round(waited, 2)))
+
+            try:
+                # Each gift's purchase deadline counts from the moment it was detected
+                await GiftMonitor._process_new_gifts(
+                    app, [{**entry['gift'], 'detected_at': entry['enqueued_at']} for entry in batch], callback)
+            except Exception as ex:
+                # One failed batch must not take detection down with it; whatever it left unfinished
+                # stays in the journal and is picked up on the next start
+                error(t("console.batch_failed", count=len(batch), error=str(ex) or type(ex).__name__))
+                traceback.print_exc()
+            finally:
+                purchase_queue.finish([entry['gift']['id'] for entry in batch])
+
+    @staticmethod
+    async def _process_new_gifts(app: Client, gifts: List[dict], callback: Callable) -> None:
         skip_counts = {'sold_out_count': 0, 'non_limited_count': 0, 'non_upgradable_count': 0}
 
-        for gift_data in new_gifts.values():
+        for gift_data in gifts:
             gift_skips = GiftDetector.categorize_skipped_gifts(gift_data)
             for key, value in gift_skips.items():
                 skip_counts[key] += value
 
-        prioritized_gifts = GiftDetector.prioritize_gifts(new_gifts, gift_ids)
-
-        for gift_id, gift_data in prioritized_gifts:
-            gift_data['id'] = gift_id
-            await callback(app, gift_data)
+        await callback(app, gifts)
 
         await send_summary_message(app, **skip_counts)
 
@@ -2,19 +2,22 @@ from typing import Optional, Tuple
 
 from pyrogram import Client
 
+from app.utils.deadline import Deadline, read_with_retries
+
 
 class UserHelper:
     @staticmethod
     async def get_user_balance(client: Client) -> int:
         try:
-            return await client.get_stars_balance()
+            return await read_with_retries(client.get_stars_balance)
         except Exception:
             return 0
 
     @staticmethod
-    async def get_recipient_info(app: Client, chat_id: int) -> Tuple[str, str]:
+    async def get_recipient_info(app: Client, chat_id: int,
+                                 deadline: Optional[Deadline] = None) -> Tuple[str, str]:
         try:
-            user = await app.get_chat(chat_id)
+            user = await read_with_retries(lambda: app.get_chat(chat_id), deadline)
             username = user.username or ""
 
             format_rules = {
@@ -0,0 +1,104 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from data.config import config
+
+
+class PurchaseJournal:
+    # pending -> sending -> done | aborted; an intent left in "sending" may or may not have been paid for.
+    # A new gift is journaled as "detected" until its plan is recorded, so it survives a crash while queued
+    RESOLVED_STATES = ('done', 'aborted', 'uncertain', 'planned')
+
+    def __init__(self, filepath: Path):
+        self.filepath = filepath
+
+    def detect(self, gift_ids: List[int]) -> None:
+        gift_ids and self._append([
+            {'id': self._detection_id(gift_id), 'gift_id': gift_id, 'state': 'detected'} for gift_id in gift_ids
+        ], sync=True)
+
+    def record(self, plan: List[Dict[str, Any]], detected_ids: List[int] = ()) -> None:
+        batch_id = time.time_ns()
+
+        for index, allocation in enumerate(plan):
+            allocation['intents'] = [
+                {
+                    'id': f"{batch_id}-{index}-{unit}",
+                    'gift_id': allocation['gift_id'],
+                    'recipient': allocation['recipient'],
+                    'price': allocation['price'],
+                    'unit': unit,
+                    'total': allocation['quantity']
+                }
+                for unit in range(1, allocation['quantity'] + 1)
+            ]
+
+        intents = [intent for allocation in plan for intent in allocation['intents']]
+        # Intents and the end of their gifts' "detected" state share one fsync, so a gift is never both
+        # re-planned and resumed after a crash
+        entries = [
+            *({**intent, 'state': 'pending'} for intent in intents),
+            *({'id': self._detection_id(gift_id), 'state': 'planned'} for gift_id in detected_ids)
+        ]
+        entries and self._append(entries, sync=True)
+
+    def begin(self, intent: Dict[str, Any]) -> None:
+        self._append([{'id': intent['id'], 'state': 'sending'}], sync=True)
+
+    def complete(self, intent: Dict[str, Any]) -> None:
+        # A lost "done" mark only downgrades the intent to uncertain, so it does not need an fsync
+        self._append([{'id': intent['id'], 'state': 'done'}], sync=False)
+
+    def resolve(self, intents: List[Dict[str, Any]], state: str = 'aborted') -> None:
+        intents and self._append([{'id': intent['id'], 'state': state} for intent in intents], sync=True)
+
+    def load_unfinished(self) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+        intents = self._load()
+        pending = [intent for intent in intents.values() if intent['state'] == 'pending']
+        uncertain = [intent for intent in intents.values() if intent['state'] == 'sending']
+        detected = [intent for intent in intents.values() if intent['state'] == 'detected']
+        return pending, uncertain, detected
+
+    def compact(self) -> None:
+        unfinished = [intent for intent in self._load().values() if intent['state'] not in self.RESOLVED_STATES]
+        temp_path = self.filepath.with_suffix('.tmp')
+
+        with temp_path.open("w", encoding='utf-8') as file:
+            file.writelines(json.dumps(intent, ensure_ascii=False) + "\n" for intent in unfinished)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_path, self.filepath)
+
+    @staticmethod
+    def _detection_id(gift_id: int) -> str:
+        return f"detected-{gift_id}"
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        intents = {}
+
+        try:
+            with self.filepath.open("r", encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn write from a crash; compaction drops it on the next startup
+                        continue
+                    intents[entry['id']] = {**intents.get(entry['id'], {}), **entry}
+        except FileNotFoundError:
+            pass
+
+        return {intent_id: intent for intent_id, intent in intents.items() if 'gift_id' in intent}
+
+    def _append(self, entries: List[Dict[str, Any]], sync: bool) -> None:
+        with self.filepath.open("a", encoding='utf-8') as file:
+            file.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+            file.flush()
+            sync and os.fsync(file.fileno())
+
+
+purchase_journal = PurchaseJournal(config.JOURNAL_FILEPATH)
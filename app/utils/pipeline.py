@@ -0,0 +1,60 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Set, Tuple
+
+
+class PurchaseQueue:
+    def __init__(self):
+        self.entries: Dict[int, Dict[str, Any]] = {}
+        self.available = asyncio.Event()
+        self.in_flight: Set[int] = set()
+        self.cancelled: Set[int] = set()
+
+    def __contains__(self, gift_id: int) -> bool:
+        return gift_id in self.entries
+
+    def put(self, gift_data: Dict[str, Any], priority: Tuple) -> None:
+        # Re-putting a queued gift refreshes its data and priority but keeps its place in the age stats
+        queued_entry = self.entries.get(gift_data['id'])
+        self.entries[gift_data['id']] = {
+            'gift': gift_data,
+            'priority': priority,
+            'enqueued_at': queued_entry['enqueued_at'] if queued_entry else time.monotonic()
+        }
+        self.available.set()
+
+    async def get_batch(self) -> List[Dict[str, Any]]:
+        while not self.entries:
+            self.available.clear()
+            await self.available.wait()
+
+        batch = sorted(self.entries.values(), key=lambda entry: entry['priority'])
+        self.entries.clear()
+        self.in_flight.update(entry['gift']['id'] for entry in batch)
+        return batch
+
+    def finish(self, gift_ids: List[int]) -> None:
+        self.in_flight.difference_update(gift_ids)
+        self.cancelled.difference_update(gift_ids)
+
+    def cancel(self, gift_id: int) -> None:
+        # Queued gifts are dropped outright; purchasers check in-flight gifts before every send
+        self.entries.pop(gift_id, None)
+        gift_id in self.in_flight and self.cancelled.add(gift_id)
+
+    def is_cancelled(self, gift_id: int) -> bool:
+        return gift_id in self.cancelled
+
+    def get_tracked_ids(self) -> Set[int]:
+        return set(self.entries) | self.in_flight
+
+    def stats(self) -> Dict[str, float]:
+        now = time.monotonic()
+        return {
+            'depth': len(self.entries),
+            'oldest_age': max((now - entry['enqueued_at'] for entry in self.entries.values()), default=0.0)
+        }
+
+
+purchase_queue = PurchaseQueue()
+get_queue_stats = purchase_queue.stats
@@ -0,0 +1,123 @@
+import asyncio
+import contextvars
+import datetime
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+from app.utils.logger import info, warn
+from data.config import config, t
+
+
+class CycleProfiler:
+    def __init__(self):
+        self.requested_cycles = 0
+        self.remaining_cycles = 0
+        self.stacks: Counter = Counter()
+        self.stop_event = threading.Event()
+        # Set only while a detection cycle runs, so the sleeps between cycles stay out of the profile
+        self.active = threading.Event()
+        self.sampler: Optional[threading.Thread] = None
+
+    def install(self) -> None:
+        # SIGUSR1 is not available on Windows; the config toggle still works there
+        hasattr(signal, 'SIGUSR1') and asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR1, self.arm, config.PROFILE_CYCLES)
+        config.PROFILE_ON_START and self.arm(config.PROFILE_CYCLES)
+
+    def arm(self, cycles: int) -> None:
+        self.sampler or info(t("console.profiler_armed", cycles=cycles))
+        self.requested_cycles = max(cycles, 1)
+
+    def cycle_started(self) -> None:
+        if self.sampler:
+            self.active.set()
+            return
+
+        if not self.requested_cycles:
+            return
+
+        self.remaining_cycles, self.requested_cycles = self.requested_cycles, 0
+        self.stacks.clear()
+        self.stop_event.clear()
+        self.active.set()
+        self.sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+        self.sampler.start()
+
+    def cycle_finished(self) -> None:
+        if not self.sampler:
+            return
+
+        self.active.clear()
+        self.remaining_cycles -= 1
+        self.remaining_cycles <= 0 and self._finish()
+
+    def _finish(self) -> None:
+        self.stop_event.set()
+        self.sampler.join()
+        self.sampler = None
+
+        config.PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+        filepath = config.PROFILES_DIR / f"profile-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+        with filepath.open("w", encoding='utf-8') as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+        info(t("console.profiler_saved", samples=sum(self.stacks.values()), path=str(filepath)))
+
+    def _sample(self, thread_id: int) -> None:
+        # Collapsed stacks ("root;...;leaf count") feed straight into flamegraph.pl or speedscope
+        while not self.stop_event.wait(config.PROFILE_SAMPLE_INTERVAL):
+            if not self.active.is_set():
+                continue
+
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack and self.stacks.update([";".join(reversed(stack))])
+
+
+class CycleTracer:
+    def __init__(self):
+        self.spans: contextvars.ContextVar[Optional[List[Tuple[int, str, float, float]]]] = \
+            contextvars.ContextVar('trace_spans', default=None)
+        self.depth: contextvars.ContextVar[int] = contextvars.ContextVar('trace_depth', default=0)
+
+    @contextmanager
+    def span(self, name: str, threshold: float = 0.0) -> Iterator[None]:
+        spans = self.spans.get()
+        is_root = spans is None
+        spans = [] if is_root else spans
+        spans_token = self.spans.set(spans) if is_root else None
+        depth = self.depth.get()
+        depth_token = self.depth.set(depth + 1)
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            spans.append((depth, name, started, elapsed))
+            self.depth.reset(depth_token)
+
+            if is_root:
+                self.spans.reset(spans_token)
+                0 < threshold < elapsed and self._dump(spans, started)
+
+    @staticmethod
+    def _dump(spans: List[Tuple[int, str, float, float]], root_started: float) -> None:
+        # The root span finishes last; its children are listed in start order with their nesting depth
+        warn(t("console.slow_cycle", name=spans[-1][1], elapsed=round(spans[-1][3] * 1000)))
+
+        for depth, name, started, elapsed in sorted(spans, key=lambda span: span[2])[1:]:
+            warn(f"{'  ' * depth}+{round((started - root_started) * 1000)} ms {name}: {round(elapsed * 1000)} ms")
+
+
+cycle_profiler = CycleProfiler()
+cycle_tracer = CycleTracer()
+trace_span = cycle_tracer.span
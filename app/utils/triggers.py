@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+from pyrogram import Client, filters, types
+from pyrogram.handlers import MessageHandler, RawUpdateHandler
+
+from app.utils.logger import info
+from data.config import config, t
+
+
+class DetectionTrigger:
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.last_fired = float('-inf')
+
+    def register(self, app: Client) -> None:
+        config.TRIGGER_UPDATES and app.add_handler(RawUpdateHandler(self._on_raw_update))
+        config.ANNOUNCEMENT_CHANNELS and app.add_handler(
+            MessageHandler(self._on_announcement, filters.chat(config.ANNOUNCEMENT_CHANNELS)))
+
+    def fire(self) -> None:
+        self.last_fired = time.monotonic()
+        self.event.set()
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        # Let the rest of an update burst arrive so it collapses into a single catalog fetch
+        await asyncio.sleep(config.TRIGGER_DEBOUNCE)
+        self.event.clear()
+        info(t("console.update_triggered"))
+        return True
+
+    async def _on_raw_update(self, client: Client, update, users: dict, chats: dict) -> None:
+        type(update).__name__ in config.TRIGGER_UPDATES and self.fire()
+
+    async def _on_announcement(self, client: Client, message: types.Message) -> None:
+        self.fire()
+
+
+detection_trigger = DetectionTrigger()
@@ -1,10 +1,11 @@
 import configparser
+import re
 import sys
 from pathlib import Path
 from typing import List, Union, Dict, Any
 
 from app.utils.localization import localization
-from app.utils.logger import error
+from app.utils.logger import error, warn
 
 
 class Config:
@@ -25,6 +26,8 @@ class Config:
         base_dir = Path(__file__).parent
         self.SESSION = str(base_dir.parent / "data/account")
         self.DATA_FILEPATH = base_dir / "json/history.json"
+        self.JOURNAL_FILEPATH = base_dir / "json/intents.jsonl"
+        self.PROFILES_DIR = base_dir / "profiles"
 
     def _setup_properties(self) -> None:
         self.API_ID = self.parser.getint('Telegram', 'API_ID', fallback=0)
@@ -34,11 +37,38 @@ class Config:
 
         self.INTERVAL = self.parser.getfloat('Bot', 'INTERVAL', fallback=15.0)
         self.LANGUAGE = self.parser.get('Bot', 'LANGUAGE', fallback='EN').lower()
+        self.BURST_INTERVAL = self.parser.getfloat('Bot', 'BURST_INTERVAL', fallback=0.0)
+        self.BURST_HORIZON = self.parser.getfloat('Bot', 'BURST_HORIZON', fallback=300.0)
+        self.SUPPLY_HISTORY_SIZE = self.parser.getint('Bot', 'SUPPLY_HISTORY_SIZE', fallback=10)
+        self.POLLERS = self.parser.getint('Bot', 'POLLERS', fallback=1)
+        self.HEDGE_WINDOW = self.parser.getfloat('Bot', 'HEDGE_WINDOW', fallback=300.0)
+        self.PURCHASE_WORKERS = self.parser.getint('Bot', 'PURCHASE_WORKERS', fallback=2)
+        self.PURCHASE_DEADLINE = self.parser.getfloat('Bot', 'PURCHASE_DEADLINE', fallback=60.0)
+        self.RPC_TIMEOUT = self.parser.getfloat('Bot', 'RPC_TIMEOUT', fallback=10.0)
+        self.RPC_RETRIES = self.parser.getint('Bot', 'RPC_RETRIES', fallback=2)
+        self.PING_INTERVAL = self.parser.getfloat('Bot', 'PING_INTERVAL', fallback=5.0)
+        self.PING_TIMEOUT = self.parser.getfloat('Bot', 'PING_TIMEOUT', fallback=3.0)
+        self.RECONNECT_ATTEMPTS = self.parser.getint('Bot', 'RECONNECT_ATTEMPTS', fallback=5)
+        self.RECONNECT_BACKOFF = self.parser.getfloat('Bot', 'RECONNECT_BACKOFF', fallback=0.5)
+        self.RECONNECT_BACKOFF_MAX = self.parser.getfloat('Bot', 'RECONNECT_BACKOFF_MAX', fallback=10.0)
+        self.TRIGGER_UPDATES = self._parse_names_list(
+            self.parser.get('Bot', 'TRIGGER_UPDATES', fallback=''))
+        self.TRIGGER_DEBOUNCE = self.parser.getfloat('Bot', 'TRIGGER_DEBOUNCE', fallback=0.3)
+        self.ANNOUNCEMENT_CHANNELS = self._parse_channels_list(
+            self.parser.get('Bot', 'ANNOUNCEMENT_CHANNELS', fallback=''))
 
         self.GIFT_RANGES = self._parse_gift_ranges()
         self.PURCHASE_ONLY_UPGRADABLE_GIFTS = self.parser.getboolean('Gifts', 'PURCHASE_ONLY_UPGRADABLE_GIFTS',
                                                                      fallback=False)
         self.PRIORITIZE_LOW_SUPPLY = self.parser.getboolean('Gifts', 'PRIORITIZE_LOW_SUPPLY', fallback=False)
+        self.PRIORITIZE_SELL_OUT = self.parser.getboolean('Gifts', 'PRIORITIZE_SELL_OUT', fallback=False)
+        self.PLAN_OBJECTIVE = self.parser.get('Gifts', 'PLAN_OBJECTIVE', fallback='rarity').strip().lower()
+
+        self.PROFILE_ON_START = self.parser.getboolean('Debug', 'PROFILE_ON_START', fallback=False)
+        self.PROFILE_CYCLES = self.parser.getint('Debug', 'PROFILE_CYCLES', fallback=5)
+        self.PROFILE_SAMPLE_INTERVAL = self.parser.getfloat('Debug', 'PROFILE_SAMPLE_INTERVAL', fallback=0.005)
+        self.SLOW_CYCLE_THRESHOLD = self.parser.getfloat('Debug', 'SLOW_CYCLE_THRESHOLD', fallback=5.0)
+        self.SLOW_PURCHASE_THRESHOLD = self.parser.getfloat('Debug', 'SLOW_PURCHASE_THRESHOLD', fallback=10.0)
 
     def _parse_channel_id(self) -> Union[int, str, None]:
         channel_value = self.parser.get('Telegram', 'CHANNEL_ID', fallback='').strip()
@@ -91,6 +121,31 @@ class Config:
             error(f"Invalid gift range format: {range_item}")
             return {}
 
+    @staticmethod
+    def _parse_names_list(names_str: str) -> List[str]:
+        return [name.strip() for name in names_str.split(',') if name.strip()]
+
+    def _parse_channels_list(self, channels_str: str) -> List[Union[int, str]]:
+        channels = []
+
+        for channel in channels_str.split(','):
+            channel = channel.strip()
+            parsed_channel = self._parse_single_channel(channel) if channel else None
+            channel and parsed_channel is None and warn(f"Invalid announcement channel skipped: {channel}")
+            parsed_channel is not None and channels.append(parsed_channel)
+
+        return channels
+
+    @staticmethod
+    def _parse_single_channel(channel: str) -> Union[int, str, None]:
+        # Channels are usually named by their -100... id; usernames work with or without the leading @
+        channel_parsers = {
+            'numeric_id': (lambda value: re.fullmatch(r'-?\d+', value), int),
+            'username': (lambda value: re.fullmatch(r'@?[A-Za-z]\w{3,31}', value), lambda value: value.lstrip('@'))
+        }
+
+        return next((handler(channel) for condition, handler in channel_parsers.values() if condition(channel)), None)
+
     def _parse_recipients_list(self, recipients_str: str) -> List[Union[int, str]]:
         recipients = []
 
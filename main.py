@@ -4,8 +4,9 @@ import traceback
 from pyrogram import Client
 
 from app.core.banner import display_title, get_app_info, set_window_title
-from app.core.callbacks import process_gift
+from app.core.callbacks import process_gifts
 from app.notifications import send_start_message
+from app.purchase import resume_purchases
 from app.utils.detector import gift_monitoring
 from app.utils.logger import info, error
 from data.config import config, t, get_language_display
@@ -26,7 +27,8 @@ class Application:
                 phone_number=config.PHONE_NUMBER
         ) as client:
             await send_start_message(client)
-            await gift_monitoring(client, process_gift)
+            await resume_purchases(client, process_gifts)
+            await gift_monitoring(client, process_gifts)
 
     @staticmethod
     def main() -> None: